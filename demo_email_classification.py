@@ -16,13 +16,8 @@ def demo_email_classification():
     print("=" * 60)
     
     try:
-        from classifiers import (
-            classify_email_content, 
-            is_suspicious_content, 
-            has_urgent_language, 
-            has_money_related_content
-        )
-        from aimodel import predict_intent
+        from classifiers import classify_text_content
+        from aimodel import predict_intents
         
         # Sample emails for demonstration
         sample_emails = [
@@ -53,25 +48,16 @@ def demo_email_classification():
             }
         ]
         
-        for i, email in enumerate(sample_emails, 1):
+        # AI classification for all emails in a single batched call
+        ai_results = predict_intents([email['content'] for email in sample_emails])
+        
+        for i, (email, (intent, confidence)) in enumerate(zip(sample_emails, ai_results), 1):
             print(f"\n📧 Email {i}: {email['name']}")
             print(f"Content: {email['content']}")
             print(f"Expected: {email['expected']}")
             
-            # Create mock payload for classification
-            import base64
-            mock_payload = {
-                'mimeType': 'text/plain',
-                'body': {
-                    'data': base64.urlsafe_b64encode(email['content'].encode('utf-8')).decode('utf-8')
-                }
-            }
-            
             # Rule-based classification
-            rule_result = classify_email_content(mock_payload)
-            
-            # AI classification
-            intent, confidence = predict_intent(email['content'])
+            rule_result = classify_text_content(email['content'])
             
             # Determine labels
             labels = []
@@ -1,13 +1,197 @@
-from transformers import pipeline
-from typing import Tuple, Optional
+from collections import Counter
+from typing import Dict, List, Tuple, Optional
+import functools
 import logging
+import os
+import re
+import threading
 
-# Initialize the zero-shot classification pipeline
 try:
-    classifier = pipeline("zero-shot-classification", model="facebook/bart-large-mnli")
-except Exception as e:
-    logging.error(f"Failed to load AI model: {e}")
-    classifier = None
+    import yake
+except ImportError:
+    yake = None
+
+# Zero-shot model, overridable e.g. with "facebook/bart-large-mnli" for the full-size model
+ZERO_SHOT_MODEL = os.environ.get("MAILSENSE_ZS_MODEL", "valhalla/distilbart-mnli-12-3")
+
+# Intra-op threads for CPU inference; defaults to half the cores, leaving room for Gmail I/O threads
+TORCH_THREADS = int(os.environ.get("MAILSENSE_TORCH_THREADS", max(1, (os.cpu_count() or 1) // 2)))
+
+# Serializes model loading and inference so concurrent callers do not oversubscribe the CPU
+_INFERENCE_LOCK = threading.Lock()
+
+# Opt-in ONNX Runtime backend for CPU inference (requires optimum[onnxruntime])
+USE_ONNX = os.environ.get("MAILSENSE_ONNX", "0") == "1"
+ONNX_CACHE_DIR = os.environ.get(
+    "MAILSENSE_ONNX_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "mailsense", "onnx")
+)
+
+def _cpu_has_vnni() -> bool:
+    """
+    Check whether the CPU exposes AVX-512 VNNI instructions for INT8 GEMM.
+    
+    Returns:
+        True if VNNI is available, False otherwise
+    """
+    try:
+        with open('/proc/cpuinfo') as cpuinfo:
+            return 'avx512_vnni' in cpuinfo.read()
+    except OSError:
+        return False
+
+def _quantize_for_cpu(model):
+    """
+    Apply INT8 dynamic quantization to the Linear layers of a model.
+    
+    Quantization is only applied when fbgemm INT8 kernels can run on a VNNI
+    capable CPU; elsewhere it tends to be slower than FP32 and the model is
+    returned unchanged.
+    
+    Args:
+        model: PyTorch model loaded on CPU
+        
+    Returns:
+        Quantized model, or the original model
+    """
+    import torch
+    
+    if not _cpu_has_vnni() or 'fbgemm' not in torch.backends.quantized.supported_engines:
+        return model
+    
+    try:
+        torch.backends.quantized.engine = 'fbgemm'
+        if torch.backends.quantized.engine != 'fbgemm':
+            return model
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    except Exception as e:
+        logging.warning(f"INT8 quantization unavailable, using FP32 model: {e}")
+        return model
+
+def _model_is_cached(model_name: str) -> bool:
+    """
+    Check whether a model is already present in the local Hugging Face cache.
+    
+    Args:
+        model_name: Hugging Face model id
+        
+    Returns:
+        True if the model config is cached, False otherwise
+    """
+    try:
+        from huggingface_hub import try_to_load_from_cache
+        return isinstance(try_to_load_from_cache(model_name, "config.json"), str)
+    except Exception:
+        return False
+
+def _load_onnx_classifier():
+    """
+    Build a zero-shot pipeline backed by an ONNX Runtime export of the model.
+    
+    The model is exported once into ONNX_CACHE_DIR. On VNNI-capable CPUs it is
+    also dynamically quantized to INT8, and that file is loaded instead.
+    
+    Returns:
+        Zero-shot classification pipeline running on ONNX Runtime
+    """
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from onnxruntime import SessionOptions
+    from transformers import AutoTokenizer, pipeline
+    
+    save_dir = os.path.join(ONNX_CACHE_DIR, ZERO_SHOT_MODEL.replace("/", "--"))
+    if not os.path.exists(os.path.join(save_dir, "model.onnx")):
+        model = ORTModelForSequenceClassification.from_pretrained(ZERO_SHOT_MODEL, export=True)
+        model.save_pretrained(save_dir)
+        AutoTokenizer.from_pretrained(ZERO_SHOT_MODEL).save_pretrained(save_dir)
+    
+    file_name = "model.onnx"
+    if _cpu_has_vnni():
+        file_name = "model_quantized.onnx"
+        if not os.path.exists(os.path.join(save_dir, file_name)):
+            quantizer = ORTQuantizer.from_pretrained(save_dir, file_name="model.onnx")
+            quantizer.quantize(
+                save_dir=save_dir,
+                quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            )
+    
+    # ONNX Runtime uses every core by default; match the PyTorch thread settings
+    session_options = SessionOptions()
+    session_options.intra_op_num_threads = TORCH_THREADS
+    session_options.inter_op_num_threads = 1
+    
+    model = ORTModelForSequenceClassification.from_pretrained(
+        save_dir,
+        file_name=file_name,
+        provider="CPUExecutionProvider",
+        session_options=session_options
+    )
+    tokenizer = AutoTokenizer.from_pretrained(save_dir)
+    return pipeline("zero-shot-classification", model=model, tokenizer=tokenizer)
+
+def _configure_torch_threads(torch):
+    """
+    Pin PyTorch CPU inference to a fixed number of threads.
+    
+    Args:
+        torch: The imported torch module
+    """
+    torch.set_num_threads(TORCH_THREADS)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Can only be set before any inter-op parallel work has started
+        pass
+
+def _get_classifier():
+    """
+    Get the zero-shot classification pipeline, loading it on first use.
+    
+    Returns:
+        Zero-shot classification pipeline, or None if loading failed
+    """
+    with _INFERENCE_LOCK:
+        return _load_classifier()
+
+@functools.lru_cache(maxsize=1)
+def _load_classifier():
+    """
+    Load the zero-shot classification pipeline.
+    
+    Returns:
+        Zero-shot classification pipeline, or None if loading failed
+    """
+    os.environ.setdefault("HF_HUB_DISABLE_TELEMETRY", "1")
+    # Skip hub network checks once the model has been downloaded
+    if _model_is_cached(ZERO_SHOT_MODEL):
+        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+    
+    try:
+        import torch
+        from transformers import pipeline
+        
+        if torch.cuda.is_available():
+            return pipeline(
+                "zero-shot-classification",
+                model=ZERO_SHOT_MODEL,
+                device=0,
+                torch_dtype=torch.float16
+            )
+        
+        _configure_torch_threads(torch)
+        
+        if USE_ONNX:
+            try:
+                return _load_onnx_classifier()
+            except Exception as e:
+                logging.warning(f"ONNX Runtime backend unavailable, using PyTorch: {e}")
+        
+        clf = pipeline("zero-shot-classification", model=ZERO_SHOT_MODEL, device=-1)
+        clf.model = _quantize_for_cpu(clf.model)
+        return clf
+    except Exception as e:
+        logging.error(f"Failed to load AI model: {e}")
+        return None
 
 # Define email intent categories
 EMAIL_INTENTS = [
@@ -25,6 +209,157 @@ EMAIL_INTENTS = [
     "marketing"
 ]
 
+SENTIMENT_LABELS = ["positive", "negative", "neutral"]
+
+PRIORITY_LABELS = ["high", "normal", "low"]
+
+# Hypothesis sentence -> (task, label) for scoring all tasks in one call
+_COMBINED_HYPOTHESES = {
+    template.format(label): (task, label)
+    for task, labels, template in [
+        ("intent", EMAIL_INTENTS, "This email is about {}."),
+        ("sentiment", SENTIMENT_LABELS, "This email has a {} tone."),
+        ("priority", PRIORITY_LABELS, "This email has {} priority."),
+    ]
+    for label in labels
+}
+
+# Result returned for a task when the email is empty or the model is unavailable
+_COMBINED_DEFAULTS = {
+    "intent": ("unknown", 0.0),
+    "sentiment": ("neutral", 0.0),
+    "priority": ("normal", 0.0),
+}
+
+# Words ignored by keyword extraction
+_STOPWORDS = frozenset({
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for',
+    'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'being',
+    'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could',
+    'should', 'may', 'might', 'must', 'can', 'this', 'that', 'these', 'those',
+    'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her', 'us', 'them'
+})
+
+# Punctuation is removed before splitting, so "team's" counts as "teams"
+_PUNCT_RE = re.compile(r'[^\w\s]')
+# Keyword candidates: words of at least 4 characters
+_WORD_RE = re.compile(r'\b\w{4,}\b')
+
+# Upper bound on characters per token, used to cap text before tokenizing
+_MAX_CHARS_PER_TOKEN = 4
+
+def _max_input_tokens(clf) -> int:
+    """
+    Get the maximum number of tokens the classifier model accepts.
+    
+    Args:
+        clf: Zero-shot classification pipeline
+        
+    Returns:
+        Model max length, capped at 1024 for tokenizers without a real limit
+    """
+    return min(getattr(clf.tokenizer, 'model_max_length', 1024), 1024)
+
+def _clip_text(text: str, max_tokens: int) -> str:
+    """
+    Strip email text and cap it before tokenization.
+    
+    The pipeline truncates the tokenized email to the model's max length
+    itself; the cap only avoids tokenizing long bodies that would be cut
+    off anyway.
+    
+    Args:
+        text: Email text content
+        max_tokens: Maximum number of tokens the model accepts
+        
+    Returns:
+        Clipped text
+    """
+    return text.strip()[:max_tokens * _MAX_CHARS_PER_TOKEN]
+
+def _run_zero_shot(clf, batch: List[str], candidate_labels: List[str],
+                   hypothesis_template: str) -> List[Dict]:
+    """
+    Call the zero-shot pipeline on a batch of texts, one caller at a time.
+    
+    Args:
+        clf: Zero-shot classification pipeline
+        batch: Non-empty email texts
+        candidate_labels: Labels to score against
+        hypothesis_template: NLI hypothesis template
+        
+    Returns:
+        List of pipeline outputs, one per text
+    """
+    with _INFERENCE_LOCK:
+        outputs = clf(
+            batch,
+            candidate_labels=candidate_labels,
+            hypothesis_template=hypothesis_template,
+            multi_label=False,
+            batch_size=min(32, len(batch) * len(candidate_labels))
+        )
+    if isinstance(outputs, dict):
+        outputs = [outputs]
+    return outputs
+
+def _zero_shot_batch(clf, texts: List[str], candidate_labels: List[str],
+                     hypothesis_template: str, default: str) -> List[Tuple[str, float]]:
+    """
+    Run zero-shot classification over several texts in a single pipeline call.
+    
+    Empty texts are not sent to the model and get the default label.
+    
+    Args:
+        clf: Zero-shot classification pipeline
+        texts: Email text contents
+        candidate_labels: Labels to score against
+        hypothesis_template: NLI hypothesis template
+        default: Label returned for empty texts
+        
+    Returns:
+        List of (label, confidence_score) tuples, one per input text
+    """
+    results = [(default, 0.0)] * len(texts)
+    indices = [i for i, text in enumerate(texts) if text and text.strip()]
+    if not indices:
+        return results
+    
+    max_tokens = _max_input_tokens(clf)
+    batch = [_clip_text(texts[i], max_tokens) for i in indices]
+    outputs = _run_zero_shot(clf, batch, candidate_labels, hypothesis_template)
+    
+    for i, output in zip(indices, outputs):
+        results[i] = (output['labels'][0], output['scores'][0])
+    
+    return results
+
+def predict_intents(texts: List[str]) -> List[Tuple[str, float]]:
+    """
+    Predict the intent of several emails using zero-shot classification.
+    
+    Args:
+        texts: Email text contents
+        
+    Returns:
+        List of (predicted_intent, confidence_score) tuples
+    """
+    clf = _get_classifier()
+    if clf is None:
+        return [("unknown", 0.0)] * len(texts)
+    
+    try:
+        return _zero_shot_batch(
+            clf,
+            texts,
+            EMAIL_INTENTS,
+            "This email is about {}.",
+            "unknown"
+        )
+    except Exception as e:
+        logging.error(f"Error in intent prediction: {e}")
+        return [("unknown", 0.0)] * len(texts)
+
 def predict_intent(text: str) -> Tuple[str, float]:
     """
     Predict the intent of an email using zero-shot classification.
@@ -35,31 +370,33 @@ def predict_intent(text: str) -> Tuple[str, float]:
     Returns:
         Tuple of (predicted_intent, confidence_score)
     """
-    if not classifier:
-        return "unknown", 0.0
+    return predict_intents([text])[0]
+
+def classify_email_sentiments(texts: List[str]) -> List[Tuple[str, float]]:
+    """
+    Classify the sentiment of several emails.
     
-    if not text or not text.strip():
-        return "unknown", 0.0
+    Args:
+        texts: Email text contents
+        
+    Returns:
+        List of (sentiment, confidence_score) tuples
+    """
+    clf = _get_classifier()
+    if clf is None:
+        return [("neutral", 0.0)] * len(texts)
     
     try:
-        clean_text = text.strip()
-        if len(clean_text) > 1000:
-            clean_text = clean_text[:1000] + "..."
-        
-        result = classifier(
-            clean_text,
-            candidate_labels=EMAIL_INTENTS,
-            hypothesis_template="This email is about {}."
+        return _zero_shot_batch(
+            clf,
+            texts,
+            SENTIMENT_LABELS,
+            "This email has a {} tone.",
+            "neutral"
         )
-        
-        predicted_intent = result['labels'][0]
-        confidence = result['scores'][0]
-        
-        return predicted_intent, confidence
-        
     except Exception as e:
-        logging.error(f"Error in intent prediction: {e}")
-        return "unknown", 0.0
+        logging.error(f"Error in sentiment classification: {e}")
+        return [("neutral", 0.0)] * len(texts)
 
 def classify_email_sentiment(text: str) -> Tuple[str, float]:
     """
@@ -71,31 +408,40 @@ def classify_email_sentiment(text: str) -> Tuple[str, float]:
     Returns:
         Tuple of (sentiment, confidence_score)
     """
-    if not classifier:
-        return "neutral", 0.0
+    return classify_email_sentiments([text])[0]
+
+def classify_email_priorities(texts: List[str], subjects: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+    """
+    Classify the priority level of several emails.
     
-    if not text or not text.strip():
-        return "neutral", 0.0
+    Args:
+        texts: Email text contents
+        subjects: Email subject lines, aligned with texts
+        
+    Returns:
+        List of (priority_level, confidence_score) tuples
+    """
+    clf = _get_classifier()
+    if clf is None:
+        return [("normal", 0.0)] * len(texts)
+    
+    subjects = subjects or [""] * len(texts)
+    combined_texts = [
+        f"Subject: {subject}\n\n{text}".strip()
+        for text, subject in zip(texts, subjects)
+    ]
     
     try:
-        clean_text = text.strip()
-        if len(clean_text) > 1000:
-            clean_text = clean_text[:1000] + "..."
-        
-        result = classifier(
-            clean_text,
-            candidate_labels=["positive", "negative", "neutral"],
-            hypothesis_template="This email has a {} tone."
+        return _zero_shot_batch(
+            clf,
+            combined_texts,
+            PRIORITY_LABELS,
+            "This email has {} priority.",
+            "normal"
         )
-        
-        predicted_sentiment = result['labels'][0]
-        confidence = result['scores'][0]
-        
-        return predicted_sentiment, confidence
-        
     except Exception as e:
-        logging.error(f"Error in sentiment classification: {e}")
-        return "neutral", 0.0
+        logging.error(f"Error in priority classification: {e}")
+        return [("normal", 0.0)] * len(texts)
 
 def classify_email_priority(text: str, subject: str = "") -> Tuple[str, float]:
     """
@@ -108,37 +454,98 @@ def classify_email_priority(text: str, subject: str = "") -> Tuple[str, float]:
     Returns:
         Tuple of (priority_level, confidence_score)
     """
-    if not classifier:
-        return "normal", 0.0
+    return classify_email_priorities([text], [subject])[0]
+
+def classify_emails(texts: List[str], subjects: Optional[List[str]] = None) -> List[Dict[str, Tuple[str, float]]]:
+    """
+    Classify intent, sentiment and priority of several emails in one pipeline call.
+    
+    All 18 hypotheses are scored in a single zero-shot call per batch and the
+    scores are renormalized within each task. Every task scores the email as
+    "Subject: ...\n\n<text>", built the same way as classify_email_priorities.
+    Priority therefore matches classify_email_priorities. Intent and sentiment
+    also see the subject, so they can differ from predict_intents and
+    classify_email_sentiments, which score only the text.
     
-    combined_text = f"Subject: {subject}\n\n{text}".strip()
+    Args:
+        texts: Email text contents
+        subjects: Email subject lines, aligned with texts
+        
+    Returns:
+        List of dicts mapping 'intent', 'sentiment' and 'priority' to
+        (label, confidence_score) tuples
+    """
+    results = [dict(_COMBINED_DEFAULTS) for _ in texts]
     
-    if not combined_text:
-        return "normal", 0.0
+    clf = _get_classifier()
+    if clf is None:
+        return results
+    
+    subjects = subjects or [""] * len(texts)
+    texts = [
+        f"Subject: {subject}\n\n{text}".strip()
+        for text, subject in zip(texts, subjects)
+    ]
+    
+    indices = [i for i, text in enumerate(texts) if text and text.strip()]
+    if not indices:
+        return results
     
     try:
-        if len(combined_text) > 1000:
-            combined_text = combined_text[:1000] + "..."
+        max_tokens = _max_input_tokens(clf)
+        batch = [_clip_text(texts[i], max_tokens) for i in indices]
+        outputs = _run_zero_shot(clf, batch, list(_COMBINED_HYPOTHESES), "{}")
         
-        result = classifier(
-            combined_text,
-            candidate_labels=["high", "normal", "low"],
-            hypothesis_template="This email has {} priority."
-        )
-        
-        predicted_priority = result['labels'][0]
-        confidence = result['scores'][0]
+        for i, output in zip(indices, outputs):
+            best: Dict[str, Tuple[str, float]] = {}
+            totals: Dict[str, float] = {}
+            for hypothesis, score in zip(output['labels'], output['scores']):
+                task, label = _COMBINED_HYPOTHESES[hypothesis]
+                totals[task] = totals.get(task, 0.0) + score
+                if task not in best:
+                    best[task] = (label, score)
+            results[i] = {
+                task: (label, score / totals[task] if totals[task] else 0.0)
+                for task, (label, score) in best.items()
+            }
+    except Exception as e:
+        logging.error(f"Error in combined email classification: {e}")
+    
+    return results
+
+def classify_email(text: str, subject: str = "") -> Dict[str, Tuple[str, float]]:
+    """
+    Classify intent, sentiment and priority of an email in one pipeline call.
+    
+    Args:
+        text: Email text content
+        subject: Email subject line
         
-        return predicted_priority, confidence
+    Returns:
+        Dict mapping 'intent', 'sentiment' and 'priority' to
+        (label, confidence_score) tuples
+    """
+    return classify_emails([text], [subject])[0]
+
+@functools.lru_cache(maxsize=8)
+def _get_keyword_extractor(max_keywords: int):
+    """
+    Build a single-word YAKE keyword extractor.
+    
+    Args:
+        max_keywords: Maximum number of keywords to extract
         
-    except Exception as e:
-        logging.error(f"Error in priority classification: {e}")
-        return "normal", 0.0
+    Returns:
+        YAKE KeywordExtractor
+    """
+    return yake.KeywordExtractor(lan="en", n=1, top=max_keywords)
 
 def extract_keywords(text: str, max_keywords: int = 5) -> list:
     """
     Extract key terms from email text.
     
+    Uses YAKE when installed, and word frequency counting otherwise.
+    
     Args:
         text: Email text content
         max_keywords: Maximum number of keywords to extract
@@ -150,23 +557,13 @@ def extract_keywords(text: str, max_keywords: int = 5) -> list:
         return []
     
     try:
-        import re
-        from collections import Counter
-        
-        clean_text = re.sub(r'[^\w\s]', '', text.lower())
-        words = clean_text.split()
+        if yake is not None:
+            extractor = _get_keyword_extractor(max_keywords)
+            return [keyword.lower() for keyword, _score in extractor.extract_keywords(text)]
         
-        stop_words = {
-            'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for',
-            'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'being',
-            'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could',
-            'should', 'may', 'might', 'must', 'can', 'this', 'that', 'these', 'those',
-            'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her', 'us', 'them'
-        }
+        words = _WORD_RE.findall(_PUNCT_RE.sub('', text.lower()))
         
-        keywords = [word for word in words if word not in stop_words and len(word) > 3]
-        
-        keyword_counts = Counter(keywords)
+        keyword_counts = Counter(word for word in words if word not in _STOPWORDS)
         top_keywords = [word for word, count in keyword_counts.most_common(max_keywords)]
         
         return top_keywords
@@ -190,8 +587,6 @@ def get_email_summary(text: str, max_length: int = 200) -> str:
         return "No content available"
     
     try:
-        import re
-
         sentences = re.split(r'[.!?]+', text.strip())
 
         sentences = [s.strip() for s in sentences if s.strip()]
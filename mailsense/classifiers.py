@@ -1,79 +1,504 @@
 import re
-import base64
-from typing import Dict, Any
+import logging
+import threading
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Union
 
-def classify_email_content(payload: Dict[str, Any]) -> Dict[str, bool]:
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    # SIMD-accelerated base64 decoding when available
+    from pybase64 import urlsafe_b64decode as _b64decode
+except ImportError:
+    from base64 import urlsafe_b64decode as _b64decode
+
+# Rule patterns for each content check
+URL_PATTERNS = [
+    r'https?://[^\s<>"]+|www\.[^\s<>"]+',  # HTTP/HTTPS and www URLs
+    r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}',  # Email addresses
+    r'ftp://[^\s<>"]+',  # FTP URLs
+]
+
+SUSPICIOUS_PATTERNS = [
+    r'urgent.*action.*required',
+    r'account.*suspended',
+    r'verify.*account',
+    r'click.*here.*immediately',
+    r'limited.*time.*offer',
+    r'free.*money',
+    r'lottery.*winner',
+    r'bank.*transfer',
+    r'password.*expired',
+    r'security.*alert',
+    r'unusual.*activity',
+    r'login.*attempt',
+    r'confirm.*details',
+    r'update.*information',
+    r'claim.*prize',
+    r'congratulations.*winner',
+    r'you.*won',
+    r'claim.*reward',
+    r'urgent.*response.*needed',
+    r'account.*locked'
+]
+
+URGENT_PATTERNS = [
+    r'urgent',
+    r'immediate.*action',
+    r'act.*now',
+    r'limited.*time',
+    r'expires.*soon',
+    r'last.*chance',
+    r'final.*notice',
+    r'deadline',
+    r'asap',
+    r'emergency',
+    r'critical',
+    r'important.*notice'
+]
+
+MONEY_PATTERNS = [
+    r'\$\d+',
+    r'dollar',
+    r'payment',
+    r'invoice',
+    r'bill',
+    r'bank.*account',
+    r'credit.*card',
+    r'paypal',
+    r'bank.*transfer',
+    r'wire.*transfer',
+    r'check',
+    r'cash',
+    r'prize.*money',
+    r'refund',
+    r'payment.*due',
+    r'overdue.*payment'
+]
+
+def _compile_alternation(patterns: list, as_bytes: bool = False) -> re.Pattern:
     """
-    Classifying emails based on rule.
+    Fuse a list of patterns into a single case-insensitive alternation.
     
     Args:
-        payload: Gmail message payload
+        patterns: Regex pattern strings
+        as_bytes: Compile a bytes pattern instead of a str pattern
+        
+    Returns:
+        Compiled pattern matching any of the inputs in one scan
+    """
+    alternation = "|".join(f"(?:{p})" for p in patterns)
+    if as_bytes:
+        return re.compile(alternation.encode('utf-8'), re.IGNORECASE)
+    return re.compile(alternation, re.IGNORECASE)
+
+# One compiled alternation per check, so content is scanned once per category
+_URL_RE = _compile_alternation(URL_PATTERNS)
+_SUSPICIOUS_RE = _compile_alternation(SUSPICIOUS_PATTERNS)
+_URGENT_RE = _compile_alternation(URGENT_PATTERNS)
+_MONEY_RE = _compile_alternation(MONEY_PATTERNS)
+
+# Result keys set by each rule category
+_RULE_CATEGORIES = [
+    ('link', URL_PATTERNS),
+    ('suspicious', SUSPICIOUS_PATTERNS),
+    ('urgent_language', URGENT_PATTERNS),
+    ('money_related', MONEY_PATTERNS),
+]
+
+_RULE_RE = {
+    'link': _URL_RE,
+    'suspicious': _SUSPICIOUS_RE,
+    'urgent_language': _URGENT_RE,
+    'money_related': _MONEY_RE,
+}
+
+# Bytes variants, used to scan decoded bodies without converting them to str
+_RULE_RE_BYTES = {
+    category: _compile_alternation(patterns, as_bytes=True)
+    for category, patterns in _RULE_CATEGORIES
+}
+
+def _build_hyperscan_database():
+    """
+    Compile all rule patterns into one Hyperscan database, if available.
+    
+    Returns:
+        Tuple of (database, category per pattern id), or (None, []) when
+        Hyperscan is not installed or cannot compile the patterns
+    """
+    if hyperscan is None:
+        return None, []
+    
+    expressions = []
+    categories = []
+    for category, patterns in _RULE_CATEGORIES:
+        for pattern in patterns:
+            expressions.append(pattern.encode('utf-8'))
+            categories.append(category)
+    
+    try:
+        database = hyperscan.Database()
+        database.compile(
+            expressions=expressions,
+            ids=list(range(len(expressions))),
+            elements=len(expressions),
+            flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH] * len(expressions)
+        )
+        return database, categories
+    except Exception as e:
+        logging.warning(f"Hyperscan unavailable, using re for rule matching: {e}")
+        return None, []
+
+_HS_DATABASE, _HS_CATEGORIES = _build_hyperscan_database()
+
+# Hyperscan scratch space must not be shared between concurrent scans
+_hs_local = threading.local()
+
+def _is_literal(pattern: str) -> bool:
+    """
+    Check whether a rule pattern is a plain keyword without regex syntax.
+    
+    Args:
+        pattern: Regex pattern string
+        
+    Returns:
+        True if the pattern only contains letters, digits and spaces
+    """
+    return re.fullmatch(r'[A-Za-z0-9 ]+', pattern) is not None
+
+def _build_keyword_matcher():
+    """
+    Build one Aho-Corasick automaton over the literal keywords of all categories.
+    
+    Patterns that are not plain keywords are compiled into per-category regex
+    alternations, searched only for categories the automaton did not match.
+    
+    Returns:
+        Tuple of (automaton, str regexes, bytes regexes), or (None, {}, {})
+        when pyahocorasick is not installed
+    """
+    if ahocorasick is None:
+        return None, {}, {}
+    
+    automaton = ahocorasick.Automaton()
+    regex_patterns = {}
+    for category, patterns in _RULE_CATEGORIES:
+        for pattern in patterns:
+            if _is_literal(pattern):
+                automaton.add_word(pattern.lower(), category)
+            else:
+                regex_patterns.setdefault(category, []).append(pattern)
+    automaton.make_automaton()
+    
+    return (
+        automaton,
+        {category: _compile_alternation(patterns) for category, patterns in regex_patterns.items()},
+        {category: _compile_alternation(patterns, as_bytes=True) for category, patterns in regex_patterns.items()},
+    )
+
+_KEYWORD_AUTOMATON, _NON_KEYWORD_RE, _NON_KEYWORD_RE_BYTES = _build_keyword_matcher()
+
+def _match_hyperscan(content: Union[str, bytes], wanted: set) -> set:
+    """
+    Match the wanted categories with a single Hyperscan pass.
+    
+    Args:
+        content: Text content to analyze, as str or UTF-8 bytes
+        wanted: Categories to look for
+        
+    Returns:
+        Set of matching categories
+    """
+    scratch = getattr(_hs_local, 'scratch', None)
+    if scratch is None:
+        scratch = _hs_local.scratch = hyperscan.Scratch(_HS_DATABASE)
+    
+    matched = set()
+    
+    def on_match(pattern_id, start, end, flags, context):
+        category = _HS_CATEGORIES[pattern_id]
+        if category in wanted:
+            matched.add(category)
+        # Returning True halts the scan once every wanted category matched
+        return len(matched) >= len(wanted)
+    
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    try:
+        _HS_DATABASE.scan(content, match_event_handler=on_match, scratch=scratch)
+    except getattr(hyperscan, 'ScanTerminated', ()):
+        pass
+    return matched
+
+def _match_keywords(content: Union[str, bytes], wanted: set) -> set:
+    """
+    Match the wanted categories with one Aho-Corasick pass over the keywords,
+    then regexes for the remaining non-keyword patterns.
+    
+    Args:
+        content: Text content to analyze, as str or UTF-8 bytes
+        wanted: Categories to look for
+        
+    Returns:
+        Set of matching categories
+    """
+    # latin-1 maps each byte to one character, so ASCII keywords match as in the bytes
+    text = content.decode('latin-1') if isinstance(content, bytes) else content
+    
+    matched = set()
+    for _end, category in _KEYWORD_AUTOMATON.iter(text.lower()):
+        if category in wanted:
+            matched.add(category)
+            if len(matched) == len(wanted):
+                return matched
+    
+    patterns = _NON_KEYWORD_RE_BYTES if isinstance(content, bytes) else _NON_KEYWORD_RE
+    for category in wanted - matched:
+        pattern = patterns.get(category)
+        if pattern is not None and pattern.search(content):
+            matched.add(category)
+    return matched
+
+def match_rule_categories(content: Union[str, bytes], skip: Optional[set] = None) -> set:
+    """
+    Find which rule categories match the content.
+    
+    Uses a single Hyperscan pass over all patterns when available, then an
+    Aho-Corasick keyword pass when pyahocorasick is available, and the
+    per-category compiled regexes otherwise.
+    
+    Args:
+        content: Text content to analyze, as str or UTF-8 bytes
+        skip: Categories already known to match, which are not checked again
         
+    Returns:
+        Set of matching result keys ('link', 'suspicious', 'urgent_language', 'money_related')
+    """
+    skip = skip or set()
+    wanted = {category for category, _patterns in _RULE_CATEGORIES if category not in skip}
+    if not wanted:
+        return set()
+    
+    if _HS_DATABASE is not None:
+        return _match_hyperscan(content, wanted)
+    
+    if _KEYWORD_AUTOMATON is not None:
+        return _match_keywords(content, wanted)
+    
+    patterns = _RULE_RE_BYTES if isinstance(content, bytes) else _RULE_RE
+    return {category for category in wanted if patterns[category].search(content)}
+
+def new_rule_result() -> Dict[str, bool]:
+    """
+    Create a classification result with every flag unset.
+    
     Returns:
         Dictionary with classification results
     """
-    result = {
+    return {
         'text': False,
         'link': False,
         'suspicious': False,
         'urgent_language': False,
         'money_related': False
     }
+
+def _has_text(content: Union[str, bytes]) -> bool:
+    """
+    Check whether content has anything besides whitespace.
     
-    content_parts = extract_content_parts(payload)
+    Bytes are decoded only when they contain non-ASCII data, so that Unicode
+    whitespace such as U+00A0 counts as whitespace, as it does for str.
     
-    for content in content_parts:
-        if content.strip():
-            result['text'] = True
-
-        if has_links(content):
-            result['link'] = True
-            
-        if has_suspicious_content(content):
-            result['suspicious'] = True
-            
-        if has_urgent_language(content):
-            result['urgent_language'] = True
-            
-        if has_money_content(content):
-            result['money_related'] = True
+    Args:
+        content: Text content, as str or UTF-8 bytes
+        
+    Returns:
+        True if the content is not blank
+    """
+    stripped = content.strip()
+    if isinstance(stripped, bytes) and stripped and not stripped.isascii():
+        stripped = stripped.decode('utf-8', errors='ignore').strip()
+    return bool(stripped)
+
+def update_rule_flags(result: Dict[str, bool], content: Union[str, bytes]):
+    """
+    Set the classification flags matched by one piece of content.
+    
+    Flags that are already set are not checked again.
+    
+    Args:
+        result: Classification results to update in place
+        content: Text content to analyze, as str or UTF-8 bytes
+    """
+    if _has_text(content):
+        result['text'] = True
+    
+    already_matched = {category for category, matched in result.items() if matched}
+    for category in match_rule_categories(content, skip=already_matched):
+        result[category] = True
+
+def classify_text_content(content: Union[str, bytes]) -> Dict[str, bool]:
+    """
+    Classify already-decoded email text based on rule.
     
+    Args:
+        content: Text content to analyze, as str or UTF-8 bytes
+        
+    Returns:
+        Dictionary with classification results
+    """
+    result = new_rule_result()
+    update_rule_flags(result, content)
     return result
 
-def extract_content_parts(payload: Dict[str, Any]) -> list:
+def classify_email_content(payload: Dict[str, Any]) -> Dict[str, bool]:
     """
-    Extract text content from Gmail message payload.
+    Classifying emails based on rule.
     
     Args:
         payload: Gmail message payload
         
     Returns:
-        List of text content strings
+        Dictionary with classification results
     """
-    content_parts = []
+    result = new_rule_result()
+    
+    # Rule checks run on the raw decoded bytes; no UTF-8 decoding is needed
+    for _mime_type, data in walk_text_parts(payload):
+        content = decode_body_bytes(data)
+        if content is None:
+            continue
+        
+        update_rule_flags(result, content)
+        
+        if all(result.values()):
+            return result
+    
+    return result
+
+def _pick_alternative(parts: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Choose the one part of a multipart/alternative to read.
     
-    def extract_from_part(part):
+    Args:
+        parts: Child parts of the multipart/alternative
+        
+    Returns:
+        The text/plain part with data if any, else the text/html one, else
+        the last (richest) alternative
+    """
+    for wanted in ('text/plain', 'text/html'):
+        for part in parts:
+            if wanted in part.get('mimeType', '') and part.get('body', {}).get('data'):
+                return part
+    return parts[-1] if parts else None
+
+def iter_text_parts(payload: Dict[str, Any]) -> Iterator[Tuple[str, str, bool]]:
+    """
+    Iterate over the text parts of a payload, marking one part per alternative.
+    
+    The MIME tree is walked with an explicit stack, in document order. Of the
+    children of each multipart/alternative, only the one chosen by
+    _pick_alternative (and its descendants) is marked as preferred.
+    
+    Args:
+        payload: Gmail message payload
+        
+    Yields:
+        Tuples of (mime_type, base64url body data, preferred) for non-empty
+        text parts
+    """
+    stack = [(payload, True)]
+    while stack:
+        part, preferred = stack.pop()
         mime_type = part.get('mimeType', '')
         
         # Handle text content
         if 'text/plain' in mime_type or 'text/html' in mime_type:
-            body = part.get('body', {})
-            data = body.get('data')
+            data = part.get('body', {}).get('data')
             if data:
-                try:
-                    content = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
-                    content_parts.append(content)
-                except Exception:
-                    pass
+                yield mime_type, data, preferred
+        
+        # The alternatives carry the same content, so one of them is preferred
+        elif 'multipart/alternative' in mime_type:
+            children = part.get('parts', [])
+            chosen = _pick_alternative(children) if preferred else None
+            stack.extend((child, child is chosen) for child in reversed(children))
         
         # Handle multipart content
         elif 'multipart' in mime_type:
-            parts = part.get('parts', [])
-            for sub_part in parts:
-                extract_from_part(sub_part)
+            stack.extend((child, preferred) for child in reversed(part.get('parts', [])))
+
+def walk_text_parts(payload: Dict[str, Any]) -> Iterator[Tuple[str, str]]:
+    """
+    Iterate over the text/plain and text/html parts of a Gmail message payload.
+    
+    The MIME tree is walked with an explicit stack, in document order.
+    
+    Args:
+        payload: Gmail message payload
+        
+    Yields:
+        Tuples of (mime_type, base64url body data) for non-empty text parts
+    """
+    for mime_type, data, _preferred in iter_text_parts(payload):
+        yield mime_type, data
+
+def decode_body_bytes(data: str) -> Optional[bytes]:
+    """
+    Decode base64url-encoded Gmail body data to raw bytes.
     
-    # Start extraction from main payload
-    extract_from_part(payload)
+    Args:
+        data: base64url body data
+        
+    Returns:
+        Decoded bytes, or None if the data cannot be decoded
+    """
+    try:
+        return _b64decode(data)
+    except Exception:
+        return None
+
+def decode_body_data(data: str) -> Optional[str]:
+    """
+    Decode base64url-encoded Gmail body data to text.
+    
+    Args:
+        data: base64url body data
+        
+    Returns:
+        Decoded text, or None if the data cannot be decoded
+    """
+    raw = decode_body_bytes(data)
+    if raw is None:
+        return None
+    return raw.decode('utf-8', errors='ignore')
+
+def extract_content_parts(payload: Dict[str, Any]) -> list:
+    """
+    Extract text content from Gmail message payload.
+    
+    Args:
+        payload: Gmail message payload
+        
+    Returns:
+        List of text content strings
+    """
+    content_parts = []
+    
+    for _mime_type, data in walk_text_parts(payload):
+        content = decode_body_data(data)
+        if content is not None:
+            content_parts.append(content)
     
     return content_parts
 
@@ -87,17 +512,7 @@ def has_links(content: str) -> bool:
     Returns:
         True if links found, False otherwise
     """
-    url_patterns = [
-        r'https?://[^\s<>"]+|www\.[^\s<>"]+',  # HTTP/HTTPS and www URLs
-        r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}',  # Email addresses
-        r'ftp://[^\s<>"]+',  # FTP URLs
-    ]
-    
-    for pattern in url_patterns:
-        if re.search(pattern, content, re.IGNORECASE):
-            return True
-    
-    return False
+    return _URL_RE.search(content) is not None
 
 
 def has_suspicious_content(content: str) -> bool:
@@ -110,35 +525,7 @@ def has_suspicious_content(content: str) -> bool:
     Returns:
         True if suspicious patterns found, False otherwise
     """
-    suspicious_patterns = [
-        r'urgent.*action.*required',
-        r'account.*suspended',
-        r'verify.*account',
-        r'click.*here.*immediately',
-        r'limited.*time.*offer',
-        r'free.*money',
-        r'lottery.*winner',
-        r'bank.*transfer',
-        r'password.*expired',
-        r'security.*alert',
-        r'unusual.*activity',
-        r'login.*attempt',
-        r'confirm.*details',
-        r'update.*information',
-        r'claim.*prize',
-        r'congratulations.*winner',
-        r'you.*won',
-        r'claim.*reward',
-        r'urgent.*response.*needed',
-        r'account.*locked'
-    ]
-    
-    content_lower = content.lower()
-    for pattern in suspicious_patterns:
-        if re.search(pattern, content_lower, re.IGNORECASE):
-            return True
-    
-    return False
+    return _SUSPICIOUS_RE.search(content) is not None
 
 
 def has_urgent_language(content: str) -> bool:
@@ -151,27 +538,7 @@ def has_urgent_language(content: str) -> bool:
     Returns:
         True if urgent language found, False otherwise
     """
-    urgent_patterns = [
-        r'urgent',
-        r'immediate.*action',
-        r'act.*now',
-        r'limited.*time',
-        r'expires.*soon',
-        r'last.*chance',
-        r'final.*notice',
-        r'deadline',
-        r'asap',
-        r'emergency',
-        r'critical',
-        r'important.*notice'
-    ]
-    
-    content_lower = content.lower()
-    for pattern in urgent_patterns:
-        if re.search(pattern, content_lower, re.IGNORECASE):
-            return True
-    
-    return False
+    return _URGENT_RE.search(content) is not None
 
 
 def has_money_content(content: str) -> bool:
@@ -184,31 +551,7 @@ def has_money_content(content: str) -> bool:
     Returns:
         True if money-related content found, False otherwise
     """
-    money_patterns = [
-        r'\$\d+',
-        r'dollar',
-        r'payment',
-        r'invoice',
-        r'bill',
-        'bank.*account',
-        r'credit.*card',
-        r'paypal',
-        r'bank.*transfer',
-        r'wire.*transfer',
-        r'check',
-        r'cash',
-        r'prize.*money',
-        r'refund',
-        r'payment.*due',
-        r'overdue.*payment'
-    ]
-    
-    content_lower = content.lower()
-    for pattern in money_patterns:
-        if re.search(pattern, content_lower, re.IGNORECASE):
-            return True
-    
-    return False
+    return _MONEY_RE.search(content) is not None
 
 
 def extract_plain_text(payload: Dict[str, Any]) -> str:
@@ -1,12 +1,38 @@
 import os
-import json
-from typing import Dict, Any, List, Optional
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+import google_auth_httplib2
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest, build_http
 import pickle
+import re
+
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
+
+from classifiers import (
+    walk_text_parts,
+    iter_text_parts,
+    decode_body_bytes,
+    decode_body_data,
+    new_rule_result,
+    update_rule_flags,
+)
 
 # Gmail API scopes
 SCOPES = [
@@ -18,6 +44,43 @@ SCOPES = [
 
 TEST_MODE = False
 
+# Authorized user credentials, stored as JSON rather than a pickled object
+TOKEN_PATH = 'token.json'
+# Pickled credentials written by older versions, converted on first load
+LEGACY_TOKEN_PATH = 'token.pickle'
+
+# Maximum number of calls packed into one Gmail batch HTTP request
+BATCH_SIZE = 50
+
+# Seconds to wait before retrying message fetches that failed in a batch
+BATCH_RETRY_DELAY = 1.0
+
+# Partial-response masks: only the parts of each resource that are read
+MESSAGE_FIELDS = 'id,threadId,labelIds,snippet,payload(mimeType,headers,parts,body)'
+LABEL_LIST_FIELDS = 'labels(id,name)'
+LABEL_FIELDS = 'id,name'
+
+# Maximum concurrent label creates when a batch request is rejected
+LABEL_CREATE_WORKERS = 6
+
+# Refresh the access token this many seconds before it expires
+TOKEN_REFRESH_MARGIN = 300
+
+# Gmail service and credentials shared by all callers in this process
+_SERVICE = None
+_CREDENTIALS = None
+_SERVICE_LOCK = threading.Lock()
+
+# Label name -> label ID, filled from labels().list on first lookup
+_LABEL_CACHE: Dict[str, str] = {}
+_LABEL_CACHE_LOADED = False
+# Guards listing, creating and reading labels across request threads
+_LABEL_LOCK = threading.RLock()
+
+# HTML stripping patterns, compiled once
+_TAG_RE = re.compile(r'<[^>]+>')
+_WS_RE = re.compile(r'\s+')
+
 def check_credentials_file():
     """
     Check if credentials.json file exists in the correct location.
@@ -51,19 +114,44 @@ def get_credentials_path():
             "and place it in the project root directory."
         )
 
-def get_gmail_service():
+def _save_credentials(creds):
     """
-    Get authenticated Gmail service instance.
+    Persist credentials to token.json.
+    
+    Args:
+        creds: OAuth credentials
+    """
+    with open(TOKEN_PATH, 'w') as token:
+        token.write(creds.to_json())
+
+def _migrate_pickled_token():
+    """
+    Convert a token.pickle left by older versions to token.json and delete it.
+    """
+    if os.path.exists(TOKEN_PATH) or not os.path.exists(LEGACY_TOKEN_PATH):
+        return
+    try:
+        with open(LEGACY_TOKEN_PATH, 'rb') as token:
+            creds = pickle.load(token)
+        _save_credentials(creds)
+        os.remove(LEGACY_TOKEN_PATH)
+    except Exception as e:
+        logging.warning(f"Failed to migrate {LEGACY_TOKEN_PATH} to {TOKEN_PATH}: {e}")
+
+def _load_credentials():
+    """
+    Load valid OAuth credentials, refreshing or re-authorizing as needed.
     
     Returns:
-        Gmail service object
+        OAuth credentials
     """
     creds = None
+    _migrate_pickled_token()
     
-    # Load existing creds from token.pickle
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
+    # Load existing creds from token.json
+    if os.path.exists(TOKEN_PATH):
+        with open(TOKEN_PATH, 'rb') as token:
+            creds = Credentials.from_authorized_user_info(_json_loads(token.read()), SCOPES)
 
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
@@ -75,17 +163,101 @@ def get_gmail_service():
                 credentials_path, SCOPES)
             creds = flow.run_local_server(port=0)
         
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
+        _save_credentials(creds)
+    
+    return creds
+
+def _refresh_credentials():
+    """
+    Refresh the cached credentials in place and schedule the next refresh.
+    """
+    with _SERVICE_LOCK:
+        creds = _CREDENTIALS
+        if creds is None or not creds.refresh_token:
+            return
+        try:
+            creds.refresh(Request())
+            _save_credentials(creds)
+        except Exception as e:
+            # Leave it to get_gmail_service to refresh on next use
+            logging.warning(f"Background token refresh failed: {e}")
+            return
+    _schedule_refresh(creds)
+
+def _schedule_refresh(creds):
+    """
+    Start a background timer that refreshes the token shortly before it expires.
     
-    return build('gmail', 'v1', credentials=creds)
+    Args:
+        creds: OAuth credentials
+    """
+    if not creds.expiry or not creds.refresh_token:
+        return
+    # Credentials keep expiry as a naive UTC datetime
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    delay = (creds.expiry - now).total_seconds() - TOKEN_REFRESH_MARGIN
+    timer = threading.Timer(max(delay, 60), _refresh_credentials)
+    timer.daemon = True
+    timer.start()
 
-def get_latest_message(service) -> Dict[str, Any]:
+def _build_request(http, *args, **kwargs):
+    """
+    Build an API request that executes on its own authorized Http.
+    
+    Used as the service's requestBuilder so the shared service can be used
+    from several threads; httplib2.Http is not thread-safe.
+    
+    Args:
+        http: The service's Http, unused
+        
+    Returns:
+        HttpRequest bound to a new authorized Http
+    """
+    return HttpRequest(_new_http(), *args, **kwargs)
+
+def get_gmail_service():
+    """
+    Get authenticated Gmail service instance.
+    
+    The service is built once per process and reused from every thread; each
+    request it builds gets its own Http. Its credentials are refreshed in
+    place when they expire.
+    
+    Returns:
+        Gmail service object
+    """
+    global _SERVICE, _CREDENTIALS
+
+    with _SERVICE_LOCK:
+        if _SERVICE is not None:
+            if not _CREDENTIALS.valid and _CREDENTIALS.refresh_token:
+                _CREDENTIALS.refresh(Request())
+                _save_credentials(_CREDENTIALS)
+            return _SERVICE
+
+        creds = _load_credentials()
+        _CREDENTIALS = creds
+        # Use the discovery document bundled with the client instead of fetching it
+        _SERVICE = build(
+            'gmail', 'v1',
+            http=_new_http(),
+            requestBuilder=_build_request,
+            cache_discovery=False,
+            static_discovery=True
+        )
+
+    _schedule_refresh(creds)
+    return _SERVICE
+
+def get_latest_message(service, format: str = 'full',
+                       metadata_headers: Optional[List[str]] = None) -> Dict[str, Any]:
     """
     Get the latest message from the inbox.
     
     Args:
         service: Gmail service object
+        format: Gmail message format; 'metadata' skips the message body
+        metadata_headers: Headers to include when format is 'metadata'
         
     Returns:
         Latest message object
@@ -94,7 +266,8 @@ def get_latest_message(service) -> Dict[str, Any]:
         results = service.users().messages().list(
             userId='me', 
             labelIds=['INBOX'],
-            maxResults=1
+            maxResults=1,
+            fields='messages(id)'
         ).execute()
         
         messages = results.get('messages', [])
@@ -103,18 +276,18 @@ def get_latest_message(service) -> Dict[str, Any]:
             raise Exception("No messages found in inbox")
         
         message_id = messages[0]['id']
-        message = service.users().messages().get(
-            userId='me', 
-            id=message_id,
-            format='full'
-        ).execute()
+        params = {'userId': 'me', 'id': message_id, 'format': format, 'fields': MESSAGE_FIELDS}
+        if format == 'metadata' and metadata_headers:
+            params['metadataHeaders'] = metadata_headers
+        message = service.users().messages().get(**params).execute()
         
         return message
         
     except HttpError as error:
         raise Exception(f"Gmail API error: {error}")
 
-def list_messages(service, label_ids: Optional[List[str]] = None, max_results: int = 50) -> List[Dict[str, Any]]:
+def list_messages(service, label_ids: Optional[List[str]] = None, max_results: int = 50,
+                  http=None) -> List[Dict[str, Any]]:
     """
     List message metadata for given label IDs.
     
@@ -122,6 +295,7 @@ def list_messages(service, label_ids: Optional[List[str]] = None, max_results: i
         service: Gmail service object
         label_ids: Gmail label IDs to filter by
         max_results: Maximum messages to return
+        http: Optional authorized Http to execute the request with
     
     Returns:
         List of message objects with id/threadId
@@ -129,16 +303,87 @@ def list_messages(service, label_ids: Optional[List[str]] = None, max_results: i
     try:
         params = {
             'userId': 'me',
-            'maxResults': max_results
+            'maxResults': max_results,
+            # Partial response: only the message references are used
+            'fields': 'messages(id,threadId)'
         }
         if label_ids:
             params['labelIds'] = label_ids
-        results = service.users().messages().list(**params).execute()
+        results = service.users().messages().list(**params).execute(http=http)
         return results.get('messages', [])
     except HttpError as error:
         raise Exception(f"Gmail API error while listing messages: {error}")
 
-def get_messages_for_all_categories(service, max_per_category: int = 20) -> List[Dict[str, Any]]:
+def batch_get_messages(service, message_ids: List[str], format: str = 'full',
+                       metadata_headers: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Fetch several messages using batched HTTP requests.
+    
+    Up to BATCH_SIZE messages().get calls are sent per HTTP request, the
+    limit Gmail recommends to stay under per-user rate limits. Messages that
+    fail to fetch, e.g. with 429, are retried once after BATCH_RETRY_DELAY
+    seconds; messages that still fail are logged and skipped.
+    
+    Args:
+        service: Gmail service object
+        message_ids: IDs of the messages to fetch
+        format: Gmail message format ('full', 'metadata', 'minimal')
+        metadata_headers: Headers to include when format is 'metadata'
+        
+    Returns:
+        List of message objects, in the order of message_ids
+    """
+    fetched: Dict[str, Dict[str, Any]] = {}
+
+    params = {'userId': 'me', 'format': format, 'fields': MESSAGE_FIELDS}
+    if format == 'metadata' and metadata_headers:
+        params['metadataHeaders'] = metadata_headers
+
+    def fetch(ids):
+        failed: Dict[str, Optional[Exception]] = {}
+
+        def on_response(request_id, response, exception):
+            if exception is None and response:
+                fetched[request_id] = response
+            else:
+                failed[request_id] = exception
+
+        for start in range(0, len(ids), BATCH_SIZE):
+            chunk = ids[start:start + BATCH_SIZE]
+            batch = service.new_batch_http_request(callback=on_response)
+            for msg_id in chunk:
+                batch.add(service.users().messages().get(id=msg_id, **params), request_id=msg_id)
+            try:
+                batch.execute()
+            except HttpError as error:
+                # Continue with the next chunk on batch-level errors
+                for msg_id in chunk:
+                    failed.setdefault(msg_id, error)
+        return failed
+
+    failed = fetch(message_ids)
+    if failed:
+        time.sleep(BATCH_RETRY_DELAY)
+        failed = fetch(list(failed))
+    for msg_id, error in failed.items():
+        logging.warning(f"Failed to fetch message {msg_id}: {error}")
+
+    return [fetched[msg_id] for msg_id in message_ids if msg_id in fetched]
+
+def _new_http():
+    """
+    Create an authorized Http for a single request.
+    
+    httplib2.Http is not thread-safe, so concurrent requests each need their
+    own. build_http() applies the client library's default socket timeout.
+    
+    Returns:
+        Authorized Http using the process-wide credentials
+    """
+    return google_auth_httplib2.AuthorizedHttp(_CREDENTIALS, http=build_http())
+
+def get_messages_for_all_categories(service, max_per_category: int = 20, format: str = 'full',
+                                    metadata_headers: Optional[List[str]] = None) -> List[Dict[str, Any]]:
     """
     Fetch recent messages across Inbox and all Gmail category tabs.
     
@@ -147,9 +392,11 @@ def get_messages_for_all_categories(service, max_per_category: int = 20) -> List
     Args:
         service: Gmail service
         max_per_category: limit per category to avoid large scans
+        format: Gmail message format; 'metadata' skips message bodies
+        metadata_headers: Headers to include when format is 'metadata'
     
     Returns:
-        List of full message objects (format='full'), de-duplicated
+        List of message objects in the requested format, de-duplicated
     """
     category_labels = [
         'INBOX',
@@ -160,31 +407,79 @@ def get_messages_for_all_categories(service, max_per_category: int = 20) -> List
         'CATEGORY_FORUMS'
     ]
 
-    seen_ids = set()
-    messages_full: List[Dict[str, Any]] = []
-
-    for label in category_labels:
+    def list_category(label):
         try:
-            meta_list = list_messages(service, label_ids=[label], max_results=max_per_category)
-            for meta in meta_list:
-                msg_id = meta.get('id')
-                if not msg_id or msg_id in seen_ids:
-                    continue
-                seen_ids.add(msg_id)
-                message = service.users().messages().get(
-                    userId='me', id=msg_id, format='full'
-                ).execute()
-                messages_full.append(message)
+            return list_messages(service, label_ids=[label], max_results=max_per_category)
         except Exception:
             # Continue on category-specific errors
-            continue
+            return []
+
+    with ThreadPoolExecutor(max_workers=len(category_labels)) as executor:
+        meta_lists = list(executor.map(list_category, category_labels))
+
+    seen_ids = set()
+    message_ids: List[str] = []
+
+    for meta_list in meta_lists:
+        for meta in meta_list:
+            msg_id = meta.get('id')
+            if not msg_id or msg_id in seen_ids:
+                continue
+            seen_ids.add(msg_id)
+            message_ids.append(msg_id)
+
+    return batch_get_messages(service, message_ids, format=format, metadata_headers=metadata_headers)
+
+def _refresh_label_cache(service):
+    """
+    Reload the label name -> ID cache with a single labels().list call.
+    
+    Args:
+        service: Gmail service object
+    """
+    global _LABEL_CACHE_LOADED
+
+    results = service.users().labels().list(userId='me', fields=LABEL_LIST_FIELDS).execute()
+    labels = {label.get('name'): label.get('id') for label in results.get('labels', [])}
+    with _LABEL_LOCK:
+        _LABEL_CACHE.clear()
+        _LABEL_CACHE.update(labels)
+        _LABEL_CACHE_LOADED = True
+
+def _new_label_body(label_name: str) -> Dict[str, str]:
+    """
+    Build the request body for creating a visible label.
+    
+    Args:
+        label_name: Name of the label
+        
+    Returns:
+        Label resource body
+    """
+    return {
+        'name': label_name,
+        'labelListVisibility': 'labelShow',
+        'messageListVisibility': 'show'
+    }
 
-    return messages_full
+def reset_label_cache():
+    """
+    Drop all cached label IDs, forcing the next lookup to re-list labels.
+    """
+    global _LABEL_CACHE_LOADED
+
+    with _LABEL_LOCK:
+        _LABEL_CACHE.clear()
+        _LABEL_CACHE_LOADED = False
 
 def create_or_get_label(service, label_name: str) -> str:
     """
     Create a new label or get existing one by name.
     
+    Label IDs are cached per process: labels are listed once, known labels
+    are resolved without an API call, and only unknown labels are created.
+    Listing and creating labels is serialized across threads.
+    
     Args:
         service: Gmail service object
         label_name: Name of the label
@@ -192,37 +487,141 @@ def create_or_get_label(service, label_name: str) -> str:
     Returns:
         Label ID
     """
-    try:
-        results = service.users().labels().list(userId='me').execute()
-        labels = results.get('labels', [])
+    label_id = _LABEL_CACHE.get(label_name)
+    if label_id:
+        return label_id
 
-        for label in labels:
-            if label.get('name') == label_name:
-                return label.get('id')
+    with _LABEL_LOCK:
+        if label_name in _LABEL_CACHE:
+            return _LABEL_CACHE[label_name]
 
-        label_object = {
-            'name': label_name,
-            'labelListVisibility': 'labelShow',
-            'messageListVisibility': 'show'
-        }
+        try:
+            if not _LABEL_CACHE_LOADED:
+                _refresh_label_cache(service)
+                if label_name in _LABEL_CACHE:
+                    return _LABEL_CACHE[label_name]
+
+            try:
+                created_label = service.users().labels().create(
+                    userId='me',
+                    body=_new_label_body(label_name),
+                    fields=LABEL_FIELDS
+                ).execute()
+                _LABEL_CACHE[label_name] = created_label.get('id')
+                return _LABEL_CACHE[label_name]
+            except HttpError:
+                # If creation failed due to a transient state, re-list and return if found
+                _refresh_label_cache(service)
+                if label_name in _LABEL_CACHE:
+                    return _LABEL_CACHE[label_name]
+                raise
+
+        except HttpError as error:
+            raise Exception(f"Error creating/getting label: {error}")
+
+def ensure_labels(service, label_names: List[str]) -> Dict[str, str]:
+    """
+    Resolve several label names to IDs, creating missing labels in a batch.
+    
+    At most one labels().list call is made, plus batched creates for labels
+    that do not exist yet. If a batch request fails as a whole, its creates
+    are sent as concurrent individual requests. Calls from different
+    threads are serialized, so they never see a half-reloaded cache.
+    
+    Args:
+        service: Gmail service object
+        label_names: Names of the labels
+        
+    Returns:
+        Dictionary mapping each label name to its ID
+    """
+    names = list(dict.fromkeys(label_names))
+
+    def on_created(request_id, response, exception):
+        if exception is None and response:
+            _LABEL_CACHE[response.get('name')] = response.get('id')
 
+    def create_label(name):
         try:
-            created_label = service.users().labels().create(
-                userId='me',
-                body=label_object
+            created = service.users().labels().create(
+                userId='me', body=_new_label_body(name), fields=LABEL_FIELDS
             ).execute()
-            return created_label.get('id')
         except HttpError:
-            # If creation failed due to a transient state, re-list and return if found
-            results = service.users().labels().list(userId='me').execute()
-            labels = results.get('labels', [])
-            for label in labels:
-                if label.get('name') == label_name:
-                    return label.get('id')
-            raise
+            # Left to the re-list below
+            return
+        _LABEL_CACHE[created.get('name')] = created.get('id')
 
-    except HttpError as error:
-        raise Exception(f"Error creating/getting label: {error}")
+    with _LABEL_LOCK:
+        try:
+            if not _LABEL_CACHE_LOADED and any(name not in _LABEL_CACHE for name in names):
+                _refresh_label_cache(service)
+
+            missing = [name for name in names if name not in _LABEL_CACHE]
+            for start in range(0, len(missing), BATCH_SIZE):
+                chunk = missing[start:start + BATCH_SIZE]
+                batch = service.new_batch_http_request(callback=on_created)
+                for name in chunk:
+                    batch.add(service.users().labels().create(
+                        userId='me', body=_new_label_body(name), fields=LABEL_FIELDS
+                    ))
+                try:
+                    batch.execute()
+                except HttpError:
+                    # Batch endpoint rejected; send the creates concurrently instead
+                    with ThreadPoolExecutor(max_workers=min(len(chunk), LABEL_CREATE_WORKERS)) as executor:
+                        list(executor.map(create_label, chunk))
+
+            # A create can fail if the label appeared meanwhile; re-list to pick it up
+            if any(name not in _LABEL_CACHE for name in missing):
+                _refresh_label_cache(service)
+
+        except HttpError as error:
+            raise Exception(f"Error creating/getting labels: {error}")
+
+        unresolved = [name for name in names if name not in _LABEL_CACHE]
+        if unresolved:
+            raise Exception(f"Error creating/getting labels: could not resolve {', '.join(unresolved)}")
+
+        return {name: _LABEL_CACHE[name] for name in names}
+
+def batch_apply_labels(service, labels_by_message: Dict[str, List[str]]) -> Dict[str, Exception]:
+    """
+    Apply labels to several messages using batched modify requests.
+    
+    Args:
+        service: Gmail service object
+        labels_by_message: Dictionary mapping message ID to label IDs to apply
+        
+    Returns:
+        Dictionary mapping message ID to the error for messages that failed
+    """
+    failures: Dict[str, Exception] = {}
+
+    def on_modified(request_id, response, exception):
+        if exception is not None:
+            failures[request_id] = exception
+
+    message_ids = list(labels_by_message)
+    for start in range(0, len(message_ids), BATCH_SIZE):
+        chunk = message_ids[start:start + BATCH_SIZE]
+        batch = service.new_batch_http_request(callback=on_modified)
+        for msg_id in chunk:
+            batch.add(
+                service.users().messages().modify(
+                    userId='me',
+                    id=msg_id,
+                    body={'addLabelIds': labels_by_message[msg_id]},
+                    fields='id'
+                ),
+                request_id=msg_id
+            )
+        try:
+            batch.execute()
+        except HttpError as error:
+            for msg_id in chunk:
+                failures.setdefault(msg_id, error)
+
+    return failures
 
 def apply_label(service, message_id: str, label_ids: List[str]):
     """
@@ -237,12 +636,35 @@ def apply_label(service, message_id: str, label_ids: List[str]):
         service.users().messages().modify(
             userId='me',
             id=message_id,
-            body={'addLabelIds': label_ids}
+            body={'addLabelIds': label_ids},
+            fields='id'
         ).execute()
         
     except HttpError as error:
         raise Exception(f"Error applying labels: {error}")
 
+def html_to_text(html: str) -> str:
+    """
+    Convert an HTML body to plain text.
+    
+    Uses selectolax when installed, which drops script/style bodies and decodes
+    entities; otherwise falls back to regex tag stripping.
+    
+    Args:
+        html: HTML content
+        
+    Returns:
+        Plain text with collapsed whitespace
+    """
+    if HTMLParser is not None:
+        tree = HTMLParser(html)
+        tree.strip_tags(['script', 'style'])
+        text = tree.text(separator=' ')
+    else:
+        # Replace tags with a space so text in adjacent elements stays separated
+        text = _TAG_RE.sub(' ', html)
+    return _WS_RE.sub(' ', text).strip()
+
 def get_message_content(message: Dict[str, Any]) -> str:
     """
     Extract text content from a Gmail message.
@@ -254,43 +676,55 @@ def get_message_content(message: Dict[str, Any]) -> str:
         Extracted text content
     """
     payload = message.get('payload', {})
-    content = ""
+    parts_out = []
     
-    def extract_from_part(part):
-        nonlocal content
+    for mime_type, data in walk_text_parts(payload):
+        text = decode_body_data(data)
+        if text is None:
+            continue
         
-        mime_type = part.get('mimeType', '')
+        if 'text/html' in mime_type:
+            text = html_to_text(text)
+        parts_out.append(text)
+    
+    return ' '.join(parts_out).strip()
+
+def walk_and_extract(payload: Dict[str, Any]) -> Tuple[Dict[str, bool], str]:
+    """
+    Classify a payload by rule and extract its text in a single MIME walk.
+    
+    Each text part is base64-decoded once and its raw bytes are scanned for
+    the rule flags. Only one part of each multipart/alternative, preferring
+    text/plain, is converted to text; the others are scanned but not decoded
+    to text, so links in an HTML twin are still detected.
+    
+    Args:
+        payload: Gmail message payload
         
-        if 'text/plain' in mime_type:
-            body = part.get('body', {})
-            data = body.get('data')
-            if data:
-                import base64
-                try:
-                    text = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
-                    content += text + " "
-                except Exception:
-                    pass
-        elif 'text/html' in mime_type:
-            body = part.get('body', {})
-            data = body.get('data')
-            if data:
-                import base64
-                try:
-                    html = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
-                    import re
-                    text = re.sub(r'<[^>]+>', '', html)
-                    text = re.sub(r'\s+', ' ', text).strip()
-                    content += text + " "
-                except Exception:
-                    pass
-        elif 'multipart' in mime_type:
-            parts = part.get('parts', [])
-            for sub_part in parts:
-                extract_from_part(sub_part)
-    
-    extract_from_part(payload)
-    return content.strip()
+    Returns:
+        Tuple of (rule classification result, extracted text content)
+    """
+    rule_result = new_rule_result()
+    parts_out = []
+    
+    for mime_type, data, preferred in iter_text_parts(payload):
+        if not preferred and all(rule_result.values()):
+            continue
+        raw = decode_body_bytes(data)
+        if raw is None:
+            continue
+        
+        if not all(rule_result.values()):
+            update_rule_flags(rule_result, raw)
+        if not preferred:
+            continue
+        
+        text = raw.decode('utf-8', errors='ignore')
+        if 'text/html' in mime_type:
+            text = html_to_text(text)
+        parts_out.append(text)
+    
+    return rule_result, ' '.join(parts_out).strip()
 
 def get_message_metadata(message: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -303,20 +737,12 @@ def get_message_metadata(message: Dict[str, Any]) -> Dict[str, Any]:
         Dictionary with message metadata
     """
     headers = message.get('payload', {}).get('headers', [])
-    metadata = {}
-    
-    for header in headers:
-        name = header.get('name', '').lower()
-        value = header.get('value', '')
-        
-        if name == 'from':
-            metadata['from'] = value
-        elif name == 'to':
-            metadata['to'] = value
-        elif name == 'subject':
-            metadata['subject'] = value
-        elif name == 'date':
-            metadata['date'] = value
+    header_map = {header.get('name', '').lower(): header.get('value', '') for header in headers}
+    metadata = {
+        name: header_map[name]
+        for name in ('from', 'to', 'subject', 'date')
+        if name in header_map
+    }
     
     metadata['id'] = message.get('id')
     metadata['thread_id'] = message.get('threadId')
@@ -1,4 +1,4 @@
-import json
+import html
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 
@@ -9,15 +9,144 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from gmail_api import (
     get_gmail_service,
     get_latest_message,
-    create_or_get_label,
+    ensure_labels,
+    reset_label_cache,
     apply_label,
-    get_message_content,
+    batch_apply_labels,
+    walk_and_extract,
     get_message_metadata,
     get_messages_for_all_categories,
 )
-from googleapiclient.errors import HttpError
-from classifiers import classify_email_content, extract_plain_text, has_links
-from aimodel import predict_intent, classify_email_sentiment, classify_email_priority, extract_keywords, get_email_summary
+from classifiers import extract_plain_text, has_links
+from aimodel import EMAIL_INTENTS, predict_intents, classify_email_sentiment, classify_email_priority, extract_keywords, get_email_summary
+
+# Every label the webhook can apply, resolved together on the first request
+STATIC_LABELS = [
+    "Contains Link",
+    "Text Only",
+    "Potential Phishing",
+    "Suspicious Content",
+    "Urgent Language",
+    "Money Related",
+    "AI:Unknown",
+    "AI:Empty",
+] + [f"AI:{intent.capitalize()}" for intent in EMAIL_INTENTS]
+
+# Messages without links and with a shorter snippet are labeled AI:Empty without the model
+EMPTY_SNIPPET_CHARS = 20
+# Snippets at least this long are classified directly instead of the extracted body
+SNIPPET_TEXT_CHARS = 200
+
+def _ai_input(message, rule_result, text):
+    """
+    Pick the text to classify for a message, using its snippet when possible.
+    
+    Args:
+        message: Gmail message with its snippet
+        rule_result: Rule classification result
+        text: Text extracted from the message body
+        
+    Returns:
+        Text for the AI model, or None when the message is empty
+    """
+    snippet = html.unescape(message.get('snippet', '')).strip()
+    if not rule_result['link'] and len(snippet) < EMPTY_SNIPPET_CHARS:
+        return None
+    if len(snippet) >= SNIPPET_TEXT_CHARS:
+        return snippet
+    return text
+
+def _build_detail(msg_id, rule_result, intent, confidence, label_ai=None):
+    """
+    Build the label names and result detail for a classified message.
+    
+    Args:
+        msg_id: Gmail message ID
+        rule_result: Rule classification result
+        intent: Predicted AI intent, or None when the message has no text
+        confidence: AI intent confidence
+        label_ai: AI label to apply instead of the one derived from the intent
+        
+    Returns:
+        Tuple of (detail, label names to apply)
+    """
+    if label_ai is None:
+        label_ai = f"AI:{intent.capitalize()}" if intent else "AI:Unknown"
+
+    # Build labels
+    labels = []
+    labels.append("Contains Link" if rule_result['link'] else "Text Only")
+    if rule_result['suspicious']:
+        labels.append("Potential Phishing" if rule_result['money_related'] else "Suspicious Content")
+    if rule_result['urgent_language']:
+        labels.append("Urgent Language")
+    if rule_result['money_related']:
+        labels.append("Money Related")
+
+    detail = {
+        "message_id": msg_id,
+        "applied_labels": labels + [label_ai],
+        "ai_label": label_ai,
+        "intent": intent,
+        "confidence": round(confidence, 2),
+        "rule_classification": rule_result,
+        "security_analysis": {
+            "suspicious": rule_result['suspicious'],
+            "urgent_language": rule_result['urgent_language'],
+            "money_related": rule_result['money_related'],
+            "potential_phishing": rule_result['suspicious'] and rule_result['money_related']
+        }
+    }
+    return detail, labels + [label_ai]
+
+def _apply_labels(service, label_names_by_message, current_label_ids):
+    """
+    Apply label names to messages, resolving IDs once and batching the modifies.
+    
+    Only labels a message does not carry yet are added, and messages that
+    already have all of them are not modified. Messages whose batched modify
+    fails are retried one by one after re-listing labels, since a cached
+    label may have been deleted in Gmail.
+    
+    Args:
+        service: Gmail service object
+        label_names_by_message: Dictionary mapping message ID to label names
+        current_label_ids: Dictionary mapping message ID to the label IDs it already has
+        
+    Returns:
+        Tuple of (dictionary mapping message ID to the error for messages that
+        could not be labeled, set of message IDs that needed no labels)
+    """
+    # Static labels are included so a cold cache creates them all in one batch
+    all_names = STATIC_LABELS + [name for names in label_names_by_message.values() for name in names]
+
+    def resolve_label_ids():
+        label_ids = ensure_labels(service, all_names)
+        missing_by_message = {}
+        for msg_id, names in label_names_by_message.items():
+            current = current_label_ids.get(msg_id, set())
+            missing_by_message[msg_id] = [label_ids[name] for name in names if label_ids[name] not in current]
+        return missing_by_message
+
+    ids_by_message = resolve_label_ids()
+    skipped = {msg_id for msg_id, ids in ids_by_message.items() if not ids}
+    failures = batch_apply_labels(
+        service,
+        {msg_id: ids for msg_id, ids in ids_by_message.items() if ids}
+    )
+    if not failures:
+        return {}, skipped
+
+    reset_label_cache()
+    ids_by_message = resolve_label_ids()
+
+    remaining = {}
+    for msg_id in failures:
+        try:
+            apply_label(service, msg_id, ids_by_message[msg_id])
+        except Exception as e:
+            remaining[msg_id] = e
+    return remaining, skipped
 
 @csrf_exempt
 def gmail_webhook(request):
@@ -27,75 +156,65 @@ def gmail_webhook(request):
     try:
         service = get_gmail_service()
 
-        # Step 1: Get recent emails across Inbox and category tabs
+        # Step 1: Get recent emails across Inbox and category tabs; the rule
+        # stage needs message bodies, so they are fetched in full in one pass
         messages = get_messages_for_all_categories(service, max_per_category=20)
         if not messages:
             return JsonResponse({"status": "success", "result": {"processed": 0, "details": []}})
 
-        processed_details = []
-        processed_count = 0
+        # Step 2: Rule classification and text extraction in one MIME walk per message
+        def extract(message):
+            try:
+                return walk_and_extract(message.get('payload', {}))
+            except Exception as e:
+                return e
+
+        extracted = [extract(message) for message in messages]
+
+        # Step 3: AI classification for all messages with text in one batched call,
+        # skipping empty messages and using the snippet when it is long enough
+        texts = [
+            _ai_input(message, *outcome) if not isinstance(outcome, Exception) else ""
+            for message, outcome in zip(messages, extracted)
+        ]
+        predictions = predict_intents([text or "" for text in texts])
 
-        for message in messages:
+        processed_details = []
+        label_names_by_message = {}
+        for message, outcome, text, (intent, confidence) in zip(messages, extracted, texts, predictions):
+            if isinstance(outcome, Exception):
+                processed_details.append({"message_id": message.get('id'), "error": str(outcome)})
+                continue
+            rule_result, _ = outcome
+            label_ai = None
+            if text is None:
+                intent, confidence, label_ai = None, 0.0, "AI:Empty"
+            elif not text.strip():
+                intent, confidence = None, 0.0
+            detail, label_names = _build_detail(message['id'], rule_result, intent, confidence, label_ai)
+            label_names_by_message[message['id']] = label_names
+            processed_details.append(detail)
+
+        # Resolve all labels once, then apply them in batched modify requests
+        failures, skipped = {}, set()
+        if label_names_by_message:
+            current_label_ids = {message['id']: set(message.get('labelIds', [])) for message in messages}
             try:
-                msg_id = message['id']
-                payload = message.get('payload', {})
-
-                # Rule-based classification
-                rule_result = classify_email_content(payload)
-
-                # Extract text content
-                text = get_message_content(message)
-
-                # AI classification
-                label_ai = "AI:Unknown"
-                if text.strip():
-                    intent, confidence = predict_intent(text)
-                    label_ai = f"AI:{intent.capitalize()}"
-                else:
-                    intent = None
-                    confidence = 0.0
-
-                # Build labels
-                labels = []
-                labels.append("Contains Link" if rule_result['link'] else "Text Only")
-                if rule_result['suspicious']:
-                    labels.append("Potential Phishing" if rule_result['money_related'] else "Suspicious Content")
-                if rule_result['urgent_language']:
-                    labels.append("Urgent Language")
-                if rule_result['money_related']:
-                    labels.append("Money Related")
-
-                # Apply labels with retry
-                def resolve_label_ids():
-                    ids = [create_or_get_label(service, l) for l in labels]
-                    ids.append(create_or_get_label(service, label_ai))
-                    return ids
-
-                label_ids = resolve_label_ids()
-                try:
-                    apply_label(service, msg_id, label_ids)
-                except HttpError:
-                    label_ids = resolve_label_ids()
-                    apply_label(service, msg_id, label_ids)
-
-                detail = {
-                    "message_id": msg_id,
-                    "applied_labels": labels + [label_ai],
-                    "ai_label": label_ai,
-                    "intent": intent,
-                    "confidence": round(confidence, 2),
-                    "rule_classification": rule_result,
-                    "security_analysis": {
-                        "suspicious": rule_result['suspicious'],
-                        "urgent_language": rule_result['urgent_language'],
-                        "money_related": rule_result['money_related'],
-                        "potential_phishing": rule_result['suspicious'] and rule_result['money_related']
-                    }
-                }
-                processed_details.append(detail)
-                processed_count += 1
+                failures, skipped = _apply_labels(service, label_names_by_message, current_label_ids)
             except Exception as e:
-                processed_details.append({"message_id": message.get('id'), "error": str(e)})
+                failures = {msg_id: e for msg_id in label_names_by_message}
+
+        for detail in processed_details:
+            if detail['message_id'] in skipped:
+                detail['skipped'] = True
+
+        processed_details = [
+            {"message_id": detail['message_id'], "error": str(failures[detail['message_id']])}
+            if 'error' not in detail and detail['message_id'] in failures else detail
+            for detail in processed_details
+        ]
+
+        processed_count = sum(1 for detail in processed_details if 'error' not in detail)
 
         return JsonResponse({"status": "success", "result": {"processed": processed_count, "details": processed_details}})
 